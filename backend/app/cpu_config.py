@@ -0,0 +1,54 @@
+"""
+cpu_config.py
+-------------
+Decides how many CPU threads/processes the backend uses.
+Stdlib-only so it can be imported before torch.
+
+APP_THREADS defaults to the CPUs actually available to this process: the
+affinity mask, further capped by the cgroup CPU quota that container hosts
+(Render, Hugging Face Spaces) use. os.cpu_count() reports the host's cores
+and would oversubscribe the container. Set the APP_THREADS env var to override.
+"""
+
+import math
+import os
+
+
+def _cgroup_cpu_limit():
+    """
+    Returns the cgroup CPU quota in whole CPUs (rounded up), or None if unlimited.
+    """
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+        return None
+    except (OSError, ValueError):
+        pass
+
+    try:
+        # cgroup v1: quota is -1 when unlimited
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    """CPUs this process can use, honouring both affinity and the cgroup quota."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    return min(cpus, limit) if limit else cpus
+
+
+APP_THREADS = int(os.environ.get("APP_THREADS", available_cpus()))
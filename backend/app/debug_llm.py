@@ -6,6 +6,9 @@ from dotenv import load_dotenv
 # Load env vars
 load_dotenv()
 
+# Reused across calls so repeated requests keep the TCP connection alive
+SESSION = requests.Session()
+
 def test_http():
     hf_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
     repo_id = "google/flan-t5-large"
@@ -21,7 +24,7 @@ def test_http():
     }
     
     try:
-        response = requests.post(api_url, headers=headers, json=payload)
+        response = SESSION.post(api_url, headers=headers, json=payload)
         print(f"Status Code: {response.status_code}")
         print(f"Response: {response.text}")
     except Exception as e:
@@ -5,11 +5,15 @@ Generates text embeddings for PDF chunks using Sentence-Transformers.
 Stores them in a local vector database (Chroma or FAISS).
 """
 
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import Normalize, Pooling, Transformer
 import numpy as np
+import hashlib
+import json
 import os
 import pickle
+import sqlite3
 import torch
 import sys
 import os
@@ -21,17 +25,264 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')
 from backend.app.pdf_processor import prepare_chunks_from_pdf
 
 
+def _copy_model_file(model_name: str, filename: str, dest_dir: str, hf_hub_download) -> Optional[str]:
+    """
+    Copies a file from a local model folder or the Hugging Face Hub into dest_dir.
+    Returns the copied path, or None (with a message) if it could not be fetched.
+    """
+    try:
+        if os.path.isdir(model_name):
+            source = os.path.join(model_name, filename)
+        else:
+            source = hf_hub_download(model_name, filename)
+        dest = os.path.join(dest_dir, filename)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(source) as src, open(dest, "w") as dst:
+            dst.write(src.read())
+        return dest
+    except Exception as e:
+        print(f" Could not fetch {filename} for {model_name}: {e}")
+        return None
+
+
 class EmbeddingGenerator:
     """
-    Handles embedding generation and storage using PyTorch backend.
+    Handles embedding generation and storage using a PyTorch backend, or an
+    INT8-quantized ONNX Runtime backend (backend="onnx", requires optimum[onnxruntime]).
     """
 
-    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
-        print(f" Loading embedding model: {model_name}")
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = SentenceTransformer(model_name, device=self.device)
+    def __init__(self,
+                 model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 batch_size: int = 64,
+                 cache_path: Optional[str] = None,
+                 cache_max_entries: int = 100000,
+                 backend: str = "torch",
+                 onnx_dir: str = "onnx_model"):
+        print(f" Loading embedding model: {model_name} ({backend})")
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.backend = backend
+
+        if backend == "onnx":
+            self.device = "cpu"
+            self.model = None
+            self._load_onnx(model_name, onnx_dir)
+        elif backend == "torch":
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            self.model = SentenceTransformer(model_name, device=self.device)
+            if self.device == "cuda":
+                self._optimize_for_gpu()
+            self.dimension = self.model.get_sentence_embedding_dimension()
+            # Short queries skip SentenceTransformer.encode when the model is a plain mean-pooled encoder
+            self._fused_query = self._is_mean_pooled_encoder()
+        else:
+            raise ValueError(f"Unknown embedding backend: {backend}")
         print(f" Model loaded on: {self.device.upper()}")
 
+        # Embeddings kept for save_embeddings (only when requested via keep=True or
+        # load_embeddings), as one contiguous (n, d) array plus parallel light metadata
+        self.vectors = np.empty((0, self.dimension), dtype=np.float32)
+        self.meta: List[Dict] = []
+
+        # Persistent embedding cache keyed by (model, chunk text hash); disabled unless
+        # cache_path is given. SQLite reuses pages freed by eviction, so capping the
+        # entry count also bounds the file size.
+        self.cache_max_entries = cache_max_entries
+        self.cache = None
+        if cache_path:
+            self.cache = sqlite3.connect(cache_path, check_same_thread=False)
+            self.cache.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB)")
+            self.cache.commit()
+
+    def _optimize_for_gpu(self):
+        """
+        Runs the model in FP16 and compiles the inner transformer.
+        Compilation is lazy, so a warm-up encode checks it actually works and
+        the eager model is restored if it fails (older torch, no Triton, etc.).
+        """
+        self.model = self.model.half()
+        eager_model = self.model[0].auto_model
+        try:
+            # Batch and query lengths vary per call; dynamic shapes avoid recompiling for each
+            self.model[0].auto_model = torch.compile(eager_model, dynamic=True)
+            self.model.encode(["warm-up"], convert_to_numpy=True, show_progress_bar=False)
+        except Exception as e:
+            self.model[0].auto_model = eager_model
+            print(f" torch.compile unavailable, using eager model: {e}")
+
+    def _is_mean_pooled_encoder(self) -> bool:
+        """
+        True if the model is exactly [Transformer, mean Pooling, (Normalize)], so the
+        fused query path produces the same vectors as SentenceTransformer.encode.
+        """
+        modules = list(self.model)
+        if len(modules) not in (2, 3):
+            return False
+        if len(modules) == 3 and not isinstance(modules[2], Normalize):
+            return False
+        # Transformer.tokenize lowercases when do_lower_case is set; the fused path does not
+        return (isinstance(modules[0], Transformer)
+                and not modules[0].do_lower_case
+                and isinstance(modules[1], Pooling)
+                and modules[1].get_pooling_mode_str() == "mean")
+
+    def _load_onnx(self, model_name: str, onnx_dir: str):
+        """
+        Exports the model to ONNX and applies dynamic INT8 quantization on first
+        use, then loads the quantized session from a per-model folder in onnx_dir.
+        """
+        try:
+            from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            from transformers import AutoTokenizer
+            from huggingface_hub import hf_hub_download
+        except ImportError as e:
+            raise ImportError("The onnx backend requires 'optimum[onnxruntime]'.") from e
+
+        # One export per model so switching model_name never reuses a stale export
+        model_dir = os.path.join(onnx_dir, model_name.replace("/", "__"))
+        quantized_file = "model_quantized.onnx"
+        if not os.path.exists(os.path.join(model_dir, quantized_file)):
+            os.makedirs(model_dir, exist_ok=True)
+            # Keep the sentence-transformers configs next to the export; they define the
+            # pooling and max_seq_length the torch backend uses
+            modules_path = _copy_model_file(model_name, "modules.json", model_dir, hf_hub_download)
+            _copy_model_file(model_name, "sentence_bert_config.json", model_dir, hf_hub_download)
+            if modules_path:
+                with open(modules_path) as f:
+                    for module in json.load(f):
+                        if module["type"].endswith(".Pooling"):
+                            _copy_model_file(model_name, f"{module['path']}/config.json", model_dir, hf_hub_download)
+            # Validate before spending time on the export
+            self._check_onnx_pooling(model_dir)
+
+            print(f" Exporting {model_name} to ONNX with INT8 quantization...")
+            ort_model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            quantizer = ORTQuantizer.from_pretrained(ort_model)
+            qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=model_dir, quantization_config=qconfig)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+        else:
+            self._check_onnx_pooling(model_dir)
+
+        ort_model = ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name=quantized_file)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.ort_session = ort_model.model
+        self.ort_input_names = [i.name for i in self.ort_session.get_inputs()]
+        self.dimension = ort_model.config.hidden_size
+
+        # Truncate and lowercase like SentenceTransformer would
+        st_config_path = os.path.join(model_dir, "sentence_bert_config.json")
+        if os.path.exists(st_config_path):
+            with open(st_config_path) as f:
+                st_config = json.load(f)
+            self.max_seq_length = st_config["max_seq_length"]
+            self.do_lower_case = st_config.get("do_lower_case", False)
+        else:
+            print(f" No sentence_bert_config.json for {model_name}; "
+                  f"truncating at tokenizer limit {self.tokenizer.model_max_length}.")
+            self.max_seq_length = self.tokenizer.model_max_length
+            self.do_lower_case = False
+
+    @staticmethod
+    def _check_onnx_pooling(model_dir: str):
+        """
+        The ONNX path always mean-pools, so refuse models whose sentence-transformers
+        pipeline is anything but [Transformer, mean Pooling, (Normalize)].
+        """
+        modules_path = os.path.join(model_dir, "modules.json")
+        if not os.path.exists(modules_path):
+            # Plain Hugging Face models get mean pooling from SentenceTransformer too
+            print(" No modules.json found; assuming mean pooling.")
+            return
+
+        with open(modules_path) as f:
+            modules = json.load(f)
+        types = [m["type"].rsplit(".", 1)[-1] for m in modules]
+        if types not in (["Transformer", "Pooling"], ["Transformer", "Pooling", "Normalize"]):
+            raise ValueError(f"The onnx backend only supports mean-pooled encoders, got modules {types}.")
+
+        pooling_path = os.path.join(model_dir, modules[1]["path"], "config.json")
+        if not os.path.exists(pooling_path):
+            raise ValueError(f"Pooling config missing for the onnx backend: {pooling_path}")
+        with open(pooling_path) as f:
+            pooling = json.load(f)
+        modes = [k for k, v in pooling.items() if k.startswith("pooling_mode") and v]
+        if modes != ["pooling_mode_mean_tokens"]:
+            raise ValueError(f"The onnx backend only supports mean pooling, got {modes}.")
+
+    def _encode_onnx(self, texts: List[str]) -> np.ndarray:
+        """
+        Runs the ONNX session batch by batch, then mean-pools and L2-normalizes.
+        """
+        outputs = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            if self.do_lower_case:
+                batch = [t.lower() for t in batch]
+            inputs = self.tokenizer(batch, padding=True, truncation=True,
+                                    max_length=self.max_seq_length, return_tensors="np")
+            feed = {name: inputs[name].astype(np.int64) for name in self.ort_input_names}
+            hidden = self.ort_session.run(None, feed)[0]
+
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.linalg.norm(pooled, axis=1, keepdims=True) + 1e-12
+            outputs.append(pooled.astype(np.float32))
+        return np.concatenate(outputs, axis=0)
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """
+        Encodes a single query string to a normalized (d,) vector.
+        """
+        if self.backend == "onnx":
+            return self._encode_onnx([query])[0]
+        if self._fused_query:
+            return self._encode_query_fused(query)
+        return self.model.encode(query, convert_to_numpy=True, normalize_embeddings=True)
+
+    def _encode_query_fused(self, query: str) -> np.ndarray:
+        """
+        Tokenizes with the already-loaded fast tokenizer and runs the transformer
+        directly, avoiding the per-call batching overhead of SentenceTransformer.encode.
+        """
+        tokens = self.model.tokenizer(query, return_tensors="pt", truncation=True,
+                                      max_length=self.model.max_seq_length).to(self.device)
+        with torch.inference_mode():
+            hidden = self.model[0].auto_model(**tokens).last_hidden_state
+            mask = tokens["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            pooled = torch.nn.functional.normalize(pooled.float(), dim=1)
+        return pooled[0].cpu().numpy()
+
+    def generate_vectors(self, text_chunks: List[Dict], keep: bool = False) -> Tuple[np.ndarray, List[Dict]]:
+        """
+        Generates embeddings for each text chunk as one stacked array.
+
+        Args:
+            text_chunks (List[Dict]): List of dicts with 'text' key.
+            keep (bool): Also store the result on the instance for a later
+                         save_embeddings() call. Leave False on shared instances.
+
+        Returns:
+            Tuple[np.ndarray, List[Dict]]: (n, d) float32 array of L2-normalized
+            embeddings, and per-chunk metadata in the same row order.
+        """
+        print(" Generating embeddings...")
+        texts = [chunk["text"] for chunk in text_chunks]
+        vectors = self._encode_cached(texts)
+
+        metadata = [{
+            "page": chunk["page"],
+            "chunk_id": chunk["chunk_id"],
+            "text": chunk["text"]
+        } for chunk in text_chunks]
+
+        if keep:
+            self.vectors, self.meta = vectors, metadata
+        print(f"Generated {len(metadata)} embeddings.")
+        return vectors, metadata
+
     def generate_embeddings(self, text_chunks: List[Dict]) -> List[Dict]:
         """
         Generates embeddings for each text chunk.
@@ -40,44 +291,134 @@ class EmbeddingGenerator:
             text_chunks (List[Dict]): List of dicts with 'text' key.
 
         Returns:
-            List[Dict]: List with embeddings added.
+            List[Dict]: List with embeddings added (L2-normalized).
         """
-        print(" Generating embeddings...")
-        embeddings_data = []
+        vectors, metadata = self.generate_vectors(text_chunks)
+        return [dict(rec, embedding=vec) for rec, vec in zip(metadata, vectors)]
+
+    def _cache_key(self, text: str) -> str:
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        # ONNX INT8 vectors differ slightly from the torch ones, so keep them apart
+        namespace = self.model_name if self.backend == "torch" else f"{self.model_name}@{self.backend}"
+        return f"{namespace}:{digest}"
+
+    def _encode_cached(self, texts: List[str]) -> np.ndarray:
+        """
+        Encodes texts, reusing cached embeddings and only running the model
+        on cache misses.
+        """
+        if self.cache is None or not texts:
+            return self._encode_sorted(texts)
+
+        keys = [self._cache_key(t) for t in texts]
+        cached = self._cache_lookup(set(keys))
+
+        # Encode each distinct missing text once
+        miss_keys = list(dict.fromkeys(k for k in keys if k not in cached))
+        if miss_keys:
+            first_text = {}
+            for k, t in zip(keys, texts):
+                first_text.setdefault(k, t)
+            new_embeddings = self._encode_sorted([first_text[k] for k in miss_keys])
+            for k, emb in zip(miss_keys, new_embeddings):
+                cached[k] = emb
+            self._cache_store(miss_keys, new_embeddings)
+
+        print(f" Embedding cache: {len(keys) - len(miss_keys)} hits, {len(miss_keys)} misses.")
+        return np.stack([cached[k] for k in keys])
 
-        for chunk in text_chunks:
-            embedding = self.model.encode(chunk["text"], convert_to_numpy=True, show_progress_bar=False)
-            embeddings_data.append({
-                "page": chunk["page"],
-                "chunk_id": chunk["chunk_id"],
-                "text": chunk["text"],
-                "embedding": embedding
-            })
+    def _cache_lookup(self, keys) -> Dict[str, np.ndarray]:
+        found = {}
+        keys = list(keys)
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.cache.execute(
+                f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})", batch)
+            for key, vec in rows:
+                found[key] = np.frombuffer(vec, dtype=np.float32)
+        return found
 
-        print(f"Generated {len(embeddings_data)} embeddings.")
-        return embeddings_data
+    def _cache_store(self, keys: List[str], embeddings: np.ndarray):
+        """Inserts new embeddings, then evicts the oldest entries beyond cache_max_entries."""
+        self.cache.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+            [(k, np.asarray(emb, dtype=np.float32).tobytes()) for k, emb in zip(keys, embeddings)])
+        (count,) = self.cache.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.cache_max_entries:
+            self.cache.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?)",
+                (count - self.cache_max_entries,))
+        self.cache.commit()
 
-    def save_embeddings(self, embeddings_data: List[Dict], output_path: str = "embeddings_store.pkl"):
+    def _encode_sorted(self, texts: List[str]) -> np.ndarray:
         """
-        Saves embeddings locally using pickle.
+        Encodes texts in length-sorted batches so each batch is padded only
+        to its longest member, then restores the original order.
         """
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        if self.backend == "onnx":
+            embeddings = self._encode_onnx(sorted_texts)
+        else:
+            embeddings = self.model.encode(
+                sorted_texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+                normalize_embeddings=True
+            )
+
+        # Invert the permutation back to the caller's order (as FP32 even if the model runs in FP16)
+        restored = np.empty(embeddings.shape, dtype=np.float32)
+        restored[order] = embeddings
+        return restored
+
+    def save_embeddings(self, embeddings_data: Optional[List[Dict]] = None, output_path: str = "embeddings_store.pkl"):
+        """
+        Saves embeddings locally: metadata is pickled to output_path and the
+        vectors go to a sidecar `output_path + ".npy"` as one FP16 array.
+        Saves the embeddings kept by generate_vectors(keep=True) or load_embeddings
+        if embeddings_data is None.
+        """
+        if embeddings_data is None:
+            vectors, meta = self.vectors, self.meta
+        else:
+            vectors = np.stack([np.asarray(rec["embedding"]) for rec in embeddings_data]) if embeddings_data \
+                else np.empty((0, self.dimension), dtype=np.float32)
+            meta = [{k: v for k, v in rec.items() if k != "embedding"} for rec in embeddings_data]
+
+        np.save(output_path + ".npy", vectors.astype(np.float16))
         with open(output_path, "wb") as f:
-            pickle.dump(embeddings_data, f)
+            pickle.dump(meta, f)
 
         print(f" Embeddings saved to {output_path}")
 
     def load_embeddings(self, path: str = "embeddings_store.pkl") -> List[Dict]:
         """
-        Loads saved embeddings from disk.
+        Loads saved embeddings from disk into self.vectors / self.meta.
+        Also reads the older single-pickle format with inline embeddings.
         """
         if not os.path.exists(path):
             raise FileNotFoundError(f"Embeddings file not found: {path}")
 
         with open(path, "rb") as f:
-            data = pickle.load(f)
+            meta = pickle.load(f)
+
+        if os.path.exists(path + ".npy"):
+            vectors = np.load(path + ".npy").astype(np.float32)
+        else:
+            vectors = np.stack([np.asarray(rec["embedding"], dtype=np.float32) for rec in meta])
+            meta = [{k: v for k, v in rec.items() if k != "embedding"} for rec in meta]
 
-        print(f" Loaded {len(data)} embeddings from {path}")
-        return data
+        self.vectors, self.meta = vectors, meta
+        print(f" Loaded {len(meta)} embeddings from {path}")
+        return [dict(rec, embedding=vec) for rec, vec in zip(meta, vectors)]
 
 
 # Example usage (standalone)
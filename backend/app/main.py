@@ -4,22 +4,61 @@ main.py
 FastAPI backend for the PDF Interaction application.
 """
 
+import asyncio
+import io
 import os
-import shutil
 import sys
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
 
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
-from backend.app.pdf_processor import prepare_chunks_from_pdf
+# CPU thread count for torch and FAISS (see cpu_config; override with APP_THREADS).
+# The BLAS/OpenMP variables must be set before torch is imported.
+from backend.app.cpu_config import APP_THREADS
+os.environ.setdefault("OMP_NUM_THREADS", str(APP_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(APP_THREADS))
+
+import torch
+from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+
+from backend.app.pdf_processor import prepare_chunks_from_pdf, shutdown_pool
 from backend.app.embeddings_generator import EmbeddingGenerator
-from backend.app.vector_store import build_faiss_index, save_index, save_metadata, _FAISS_AVAILABLE
+from backend.app.vector_store import build_faiss_index, save_index, save_metadata, faiss, _FAISS_AVAILABLE
 from backend.app.rag_pipeline import RAGPipeline
 
-app = FastAPI(title="PDF Interaction API")
+torch.set_num_threads(APP_THREADS)
+if _FAISS_AVAILABLE:
+    faiss.omp_set_num_threads(APP_THREADS)
+
+# Define Global Paths (Use /tmp for Docker permissions)
+INDEX_PATH = "/tmp/faiss_index.idx"
+META_PATH = "/tmp/meta_store.arrow"
+
+# Global embedding model and RAG pipeline, created at app startup rather than
+# import time so spawned PDF worker processes (which re-import __main__) don't load them
+EMBEDDER = None
+rag_pipeline = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global EMBEDDER, rag_pipeline
+    # Embedding model loaded once and shared by upload and query paths
+    # EMBEDDING_BACKEND=onnx selects the quantized ONNX Runtime encoder
+    EMBEDDER = EmbeddingGenerator(
+        cache_path="/tmp/embeddings_cache.sqlite",
+        backend=os.environ.get("EMBEDDING_BACKEND", "torch"),
+        onnx_dir="/tmp/onnx_model"
+    )
+    rag_pipeline = RAGPipeline(index_path=INDEX_PATH, meta_path=META_PATH, embedder=EMBEDDER)
+    yield
+    shutdown_pool()
+
+
+app = FastAPI(title="PDF Interaction API", lifespan=lifespan)
 
 # CORS Setup (Allow frontend to connect)
 app.add_middleware(
@@ -30,13 +69,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Define Global Paths (Use /tmp for Docker permissions)
-INDEX_PATH = "/tmp/faiss_index.idx"
-META_PATH = "/tmp/meta_store.pkl"
-
-# Global RAG Pipeline instance
-rag_pipeline = RAGPipeline(index_path=INDEX_PATH, meta_path=META_PATH)
-
 class QueryRequest(BaseModel):
     question: str
 
@@ -52,33 +84,21 @@ async def upload_pdf(file: UploadFile = File(...)):
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="File must be a PDF.")
 
-    # Save file locally (use /tmp for write permissions in Docker)
-    file_location = f"/tmp/uploaded_{file.filename}"
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
     try:
-        # 1. Extract and Chunk
+        # 1. Extract and Chunk (parsed from memory, no temp file)
         print(f"Processing {file.filename}...")
-        chunks = prepare_chunks_from_pdf(file_location)
+        data = await file.read()
+        chunks = prepare_chunks_from_pdf(io.BytesIO(data))
         
         if not chunks:
              raise HTTPException(status_code=400, detail="No text extracted from PDF.")
 
         # 2. Generate Embeddings
-        embedder = EmbeddingGenerator()
-        embeddings_data = embedder.generate_embeddings(chunks)
+        vectors, metadata = EMBEDDER.generate_vectors(chunks)
         
         # 3. Update Vector Store
         # Prepare data for vector store
-        import numpy as np
-        vectors = np.stack([rec["embedding"] for rec in embeddings_data])
-        metadata = [{
-            "text": rec["text"],
-            "page": rec["page"],
-            "chunk_id": rec["chunk_id"],
-            "source": file.filename
-        } for rec in embeddings_data]
+        metadata = [dict(rec, source=file.filename) for rec in metadata]
 
         # Save to disk
         # Save to disk
@@ -91,9 +111,6 @@ async def upload_pdf(file: UploadFile = File(...)):
         # Reload RAG pipeline with new data
         rag_pipeline.reload_index()
         
-        # Cleanup
-        os.remove(file_location)
-        
         return {"message": "PDF processed and indexed successfully.", "chunks_count": len(chunks)}
 
     except Exception as e:
@@ -108,7 +125,11 @@ async def query_pdf(request: QueryRequest):
     if not rag_pipeline.index and not rag_pipeline.metadata:
         raise HTTPException(status_code=400, detail="No PDF indexed. Please upload a PDF first.")
     
-    answer = rag_pipeline.answer_query(request.question)
+    # Retrieval stays on the event loop so it is serialized with reload_index and
+    # never touches the shared model or index concurrently. Only the blocking LLM
+    # HTTP call runs in a worker thread.
+    context_chunks = rag_pipeline.retrieve_context(request.question)
+    answer = await asyncio.to_thread(rag_pipeline.generate_answer, request.question, context_chunks)
     return {"answer": answer}
 
 if __name__ == "__main__":
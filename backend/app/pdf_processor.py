@@ -5,35 +5,111 @@ Handles PDF reading, text extraction, cleaning, and chunking for the
 'Automating PDF Interaction using LangChain and Open-Source LLMs' project.
 """
 
+import io
+import multiprocessing
 import os
-from typing import List, Dict
+import sys
+import threading
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import accumulate
+from typing import List, Dict, BinaryIO, Tuple, Union
 from pypdf import PdfReader
 
-def extract_text_from_pdf(pdf_path: str) -> List[Dict]:
+# Add the project root directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from backend.app.cpu_config import APP_THREADS
+
+# PDFs with fewer pages than this are extracted serially
+PARALLEL_MIN_PAGES = 8
+
+# Shared extraction pool, created on first use. Workers are spawned rather than
+# forked so they don't inherit the server's model, CUDA context or thread pools.
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=APP_THREADS, mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+
+def shutdown_pool():
+    """Shuts down the shared extraction pool; a new one is created on next use."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = None
+
+def extract_text_from_pdf(pdf_path: Union[str, BinaryIO]) -> List[Dict]:
     """
     Extracts text from each page of the given PDF.
 
     Args:
-        pdf_path (str): Path to the uploaded PDF file.
+        pdf_path (str | BinaryIO): Path to the PDF file, or a binary file-like
+                                   object holding its contents.
 
     Returns:
         List[Dict]: A list of dictionaries, each containing
                     {'page': int, 'text': str}.
     """
-    if not os.path.exists(pdf_path):
-        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
-    
-    reader = PdfReader(pdf_path)
+    if isinstance(pdf_path, str):
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+    else:
+        # Worker processes need a picklable source, so hold in-memory PDFs as bytes
+        pdf_path = pdf_path.getvalue() if isinstance(pdf_path, io.BytesIO) else pdf_path.read()
+
+    reader = _open_reader(pdf_path)
+    num_pages = len(reader.pages)
+    workers = min(APP_THREADS, num_pages)
+
+    # Process start-up outweighs the gain for short documents
+    if num_pages < PARALLEL_MIN_PAGES or workers < 2:
+        return _extract_page_range(pdf_path, 0, num_pages, reader)
+
+    # One contiguous page range per worker so each process opens the PDF once
+    bounds = [num_pages * w // workers for w in range(workers + 1)]
+    try:
+        results = _get_pool().map(partial(_extract_page_range, pdf_path), bounds[:-1], bounds[1:])
+        return [page for page_range in results for page in page_range]
+    except BrokenProcessPool as e:
+        # A worker died (crash, OOM kill); drop the pool so the next upload gets a fresh one
+        print(f" PDF extraction pool broke, extracting serially: {e}")
+        shutdown_pool()
+        return _extract_page_range(pdf_path, 0, num_pages, reader)
+
+
+def _open_reader(pdf_path: Union[str, bytes]) -> PdfReader:
+    if isinstance(pdf_path, bytes):
+        return PdfReader(io.BytesIO(pdf_path))
+    return PdfReader(pdf_path)
+
+
+def _extract_page_range(pdf_path: Union[str, bytes], start: int, stop: int, reader: PdfReader = None) -> List[Dict]:
+    """
+    Extracts and cleans pages [start, stop) of the PDF.
+    Top-level so it can run in a worker process.
+    """
+    if reader is None:
+        reader = _open_reader(pdf_path)
     pages_data = []
-    
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text() or ""
+
+    for i in range(start, stop):
+        text = reader.pages[i].extract_text() or ""
         clean_text = clean_pdf_text(text)
         pages_data.append({
             "page": i+1,
             "text": clean_text
         })
-    return pages_data        
+    return pages_data
 
 def clean_pdf_text(text: str) ->str:
     """
@@ -62,44 +138,67 @@ def chunk_text(text: str, max_words: int = 200, overlap: int = 50) -> List[str]:
     Returns:
         List[str]: List of text chunks.
     """
-    words = text.split()
+    return [chunk for _, chunk in _chunk_words(text.split(), max_words, overlap)]
+
+
+def _chunk_words(words: List[str], max_words: int = 200, overlap: int = 50) -> List[Tuple[int, str]]:
+    """
+    Builds overlapping chunks from a word list.
+
+    Returns:
+        List[Tuple[int, str]]: (index of the chunk's first word, chunk text) pairs.
+    """
+    if not words:
+        return []
+
+    # Join once and slice chunks out by word offsets instead of re-joining
+    # every overlapping window
+    joined = " ".join(words)
+    offsets = list(accumulate((len(w) + 1 for w in words[:-1]), initial=0))
     chunks = []
-    start = 0
 
-    while start < len(words):
-        end = start + max_words
-        chunk = " ".join(words[start:end])
-        chunks.append(chunk)
-        start += max_words - overlap
+    for start in range(0, len(words), max_words - overlap):
+        last = min(start + max_words, len(words)) - 1
+        chunks.append((start, joined[offsets[start]:offsets[last] + len(words[last])]))
 
     return chunks
 
 
-def prepare_chunks_from_pdf(pdf_path: str) -> List[Dict]:
+def prepare_chunks_from_pdf(pdf_path: Union[str, BinaryIO]) -> List[Dict]:
     """
     Complete preprocessing pipeline:
     1. Extract text from PDF
     2. Clean text
     3. Chunk text
-    Combines all pages into a single structured list.
+    Pages are concatenated and chunked as one stream so chunks can span page
+    breaks; each chunk is tagged with the page it starts on.
 
     Args:
-        pdf_path (str): Path to the PDF file.
+        pdf_path (str | BinaryIO): Path to the PDF file, or a binary file-like object.
 
     Returns:
         List[Dict]: List of chunk dictionaries with page and text.
     """
     pages = extract_text_from_pdf(pdf_path)
-    all_chunks = []
+    words = []
+    page_breaks = []   # index of the first word of each page in `words`
+    page_numbers = []
 
     for page_data in pages:
-        chunks = chunk_text(page_data["text"])
-        for idx, chunk in enumerate(chunks):
-            all_chunks.append({
-                "page": page_data["page"],
-                "chunk_id": idx + 1,
-                "text": chunk
-            })
+        page_words = page_data["text"].split()
+        if not page_words:
+            continue
+        page_breaks.append(len(words))
+        page_numbers.append(page_data["page"])
+        words.extend(page_words)
+
+    all_chunks = []
+    for idx, (start, chunk) in enumerate(_chunk_words(words)):
+        all_chunks.append({
+            "page": page_numbers[bisect_right(page_breaks, start) - 1],
+            "chunk_id": idx + 1,
+            "text": chunk
+        })
 
     return all_chunks
 
@@ -7,6 +7,8 @@ Uses LangChain and HuggingFace to answer user queries based on PDF context.
 
 import os
 import sys
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 
@@ -19,21 +21,31 @@ from langchain_core.output_parsers import StrOutputParser
 
 # Import our local vector store helper
 from backend.app.vector_store import load_index, load_metadata, search_index, _FAISS_AVAILABLE
+from backend.app.embeddings_generator import EmbeddingGenerator
 
 # Load environment variables
 load_dotenv()
 
+# Maximum number of query embeddings kept in the LRU cache
+QUERY_CACHE_SIZE = 512
+
 class RAGPipeline:
     def __init__(self, 
                  index_path: str = "faiss_index.idx", 
-                 meta_path: str = "meta_store.pkl",
-                 model_repo_id: str = "meta-llama/Llama-3.1-8B-Instruct"):
+                 meta_path: str = "meta_store.arrow",
+                 model_repo_id: str = "meta-llama/Llama-3.1-8B-Instruct",
+                 embedder: Optional[EmbeddingGenerator] = None):
         """
         Initialize the RAG pipeline.
+        Pass a shared `embedder` to avoid loading the embedding model twice.
         """
         self.index_path = index_path
         self.meta_path = meta_path
         self.repo_id = model_repo_id
+        self.embedder = embedder if embedder is not None else EmbeddingGenerator()
+        # LRU cache of query embeddings; queries may arrive from several worker threads
+        self._qcache = OrderedDict()
+        self._qcache_lock = threading.Lock()
         
         # Load Vector Store
         try:
@@ -52,6 +64,7 @@ class RAGPipeline:
         if not hf_token:
             print(" HUGGINGFACEHUB_API_TOKEN not found in .env. LLM might fail.")
         
+        # Created once and reused for every query so its HTTP session keeps connections alive
         try:
             print(f"Loading Inference Client for: {self.repo_id}")
             from huggingface_hub import InferenceClient
@@ -67,11 +80,10 @@ class RAGPipeline:
     def reload_index(self):
         """Reloads the index and metadata (useful after a new upload)."""
         try:
-            self.metadata = load_metadata(self.meta_path)
-            if _FAISS_AVAILABLE:
-                self.index = load_index(self.index_path)
-            else:
-                self.index = None
+            # Load both before swapping so metadata and index always match
+            metadata = load_metadata(self.meta_path)
+            index = load_index(self.index_path) if _FAISS_AVAILABLE else None
+            self.metadata, self.index = metadata, index
             print(" RAG Pipeline: Index reloaded.")
         except Exception as e:
             print(f" Could not reload index: {e}")
@@ -82,12 +94,8 @@ class RAGPipeline:
         """
         if not self.metadata:
             return []
-            
-        from backend.app.embeddings_generator import EmbeddingGenerator
-        if not hasattr(self, 'embedder'):
-             self.embedder = EmbeddingGenerator()
 
-        query_embedding = self.embedder.model.encode(query, convert_to_numpy=True)
+        query_embedding = self._embed_query(query)
         
         results = search_index(query_embedding, self.index, self.metadata, top_k=top_k)
         
@@ -95,21 +103,50 @@ class RAGPipeline:
         context_chunks = [res[0]['text'] for res in results]
         return context_chunks
 
+    def _embed_query(self, query: str):
+        """
+        Returns the query embedding, reusing a cached one for repeated questions.
+        Callers get a copy, so in-place normalization cannot corrupt the cache.
+        """
+        with self._qcache_lock:
+            cached = self._qcache.get(query)
+            if cached is not None:
+                self._qcache.move_to_end(query)
+                return cached.copy()
+
+        embedding = self.embedder.encode_query(query)
+        embedding.setflags(write=False)
+
+        with self._qcache_lock:
+            self._qcache[query] = embedding
+            self._qcache.move_to_end(query)
+            if len(self._qcache) > QUERY_CACHE_SIZE:
+                self._qcache.popitem(last=False)
+        return embedding.copy()
+
     def answer_query(self, query: str) -> str:
         """
         End-to-end RAG: Retrieve context -> Generate Answer using Chat Completion.
         """
+        # 1. Retrieve
+        context_chunks = self.retrieve_context(query)
+        # 2. Generate
+        return self.generate_answer(query, context_chunks)
+
+    def generate_answer(self, query: str, context_chunks: List[str]) -> str:
+        """
+        Generates an answer from already-retrieved context using Chat Completion.
+        Only makes the blocking LLM call, so it is safe to run in a worker thread.
+        """
         if not self.client:
             return "Error: Client not initialized. Check API token."
 
-        # 1. Retrieve
-        context_chunks = self.retrieve_context(query)
         if not context_chunks:
             return "I couldn't find any relevant information in the uploaded PDF."
         
         context_str = "\n\n".join(context_chunks)
         
-        # 2. Generate using Chat Completion API
+        # Generate using Chat Completion API
         # This avoids the "text-generation" task restriction
         messages = [
             {
@@ -3,7 +3,7 @@ vector_store.py
 ---------------
 FAISS-based vector store helper for storing/searching embeddings.
 Falls back to a basic in-memory search if FAISS is not available.
-Saves/loads index and metadata (pickle) for persistence.
+Saves/loads the index and a memory-mapped Arrow metadata file for persistence.
 
 Functions:
 - build_faiss_index(embeddings, index_path, meta_path)
@@ -12,12 +12,14 @@ Functions:
 - load_index(index_path)
 - save_metadata(metadata_list, meta_path)
 - load_metadata(meta_path)
-- search_index(query_vec, index, metadata_list, top_k=5)
+- search_index(query_vec, index, metadata_list, top_k=5, nprobe=8, ef_search=64)
 """
 
 import os
 import pickle
+from collections.abc import Sequence
 import numpy as np
+import pyarrow as pa
 
 # Try to import faiss; if not available, fallback to in-memory
 try:
@@ -28,20 +30,109 @@ except Exception:
     _FAISS_AVAILABLE = False
     print("Warning: FAISS not available. Falling back to in-memory search (slower).")
 
+# Corpora at least this large use an HNSW graph instead of a full-scan index
+HNSW_MIN_VECTORS = 2000
+# Corpora at least this large use IVF-PQ
+IVF_PQ_MIN_VECTORS = 10000
+# Number of IVF cells probed per query
+DEFAULT_NPROBE = 8
+# HNSW graph degree and candidate list sizes for build and search
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+DEFAULT_EF_SEARCH = 64
+
+# Move indexes to GPU when a CUDA-enabled FAISS build finds a device
+_GPU_AVAILABLE = _FAISS_AVAILABLE and hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0
+_GPU_RESOURCES = faiss.StandardGpuResources() if _GPU_AVAILABLE else None
+
+
+def _to_gpu(index):
+    """
+    Copies a CPU index to GPU 0 if available; returns the CPU index otherwise.
+    Only flat and IVF indexes have GPU implementations, other types stay on CPU.
+    """
+    if not _GPU_AVAILABLE or not isinstance(index, (faiss.IndexFlat, faiss.IndexIVF)):
+        return index
+    options = faiss.GpuClonerOptions()
+    options.useFloat16 = True  # FP16 storage, like the CPU scalar-quantized index
+    try:
+        return faiss.index_cpu_to_gpu(_GPU_RESOURCES, 0, index, options)
+    except Exception as e:
+        print(f" Could not move FAISS index to GPU, using CPU: {e}")
+        return index
+
+
+def _to_cpu(index):
+    if _GPU_AVAILABLE and type(index).__name__.startswith("Gpu"):
+        return faiss.index_gpu_to_cpu(index)
+    return index
+
 # ---------------------------
 # Persistence helpers
 # ---------------------------
-def save_metadata(metadata_list, meta_path="meta_store.pkl"):
-    with open(meta_path, "wb") as f:
-        pickle.dump(metadata_list, f)
+class MetadataTable(Sequence):
+    """
+    Read-only list-like view over an Arrow table of metadata records.
+    Rows are only materialized as dicts when indexed, so a memory-mapped
+    table is paged in lazily by the OS.
+    """
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("metadata index out of range")
+        rec = self.table.slice(idx, 1).to_pylist()[0]
+        if rec.get("embedding") is not None:
+            rec["embedding"] = np.asarray(rec["embedding"], dtype=np.float32)
+        return rec
+
+    def embedding_matrix(self) -> np.ndarray:
+        """Returns the 'embedding' column as an (n, d) array without per-row copies."""
+        if "embedding" not in self.table.column_names:
+            raise ValueError("Metadata records must contain 'embedding' for in-memory search fallback.")
+        column = self.table.column("embedding").combine_chunks()
+        return column.flatten().to_numpy().reshape(len(self), -1)
+
+
+def save_metadata(metadata_list, meta_path="meta_store.arrow"):
+    records = list(metadata_list)
+    embeddings = None
+    if records and records[0].get("embedding") is not None:
+        # Store vectors as one contiguous fixed-size-list column
+        embeddings = np.stack([np.asarray(r["embedding"], dtype=np.float32) for r in records])
+        records = [{k: v for k, v in r.items() if k != "embedding"} for r in records]
+
+    table = pa.Table.from_pylist(records)
+    if embeddings is not None:
+        n, d = embeddings.shape
+        column = pa.FixedSizeListArray.from_arrays(pa.array(embeddings.ravel()), d)
+        table = table.append_column("embedding", column)
+
+    # Written uncompressed so load_metadata can memory-map it zero-copy. Write to a
+    # temp file and rename so a live map of the previous file keeps its old inode.
+    tmp_path = meta_path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, meta_path)
     print(f" Saved metadata to {meta_path}")
 
 
-def load_metadata(meta_path="meta_store.pkl"):
+def load_metadata(meta_path="meta_store.arrow"):
     if not os.path.exists(meta_path):
         raise FileNotFoundError(f"Metadata file not found: {meta_path}")
-    with open(meta_path, "rb") as f:
-        metadata_list = pickle.load(f)
+    table = pa.ipc.open_file(pa.memory_map(meta_path, "r")).read_all()
+    metadata_list = MetadataTable(table)
     print(f" Loaded {len(metadata_list)} metadata records from {meta_path}")
     return metadata_list
 
@@ -49,7 +140,7 @@ def load_metadata(meta_path="meta_store.pkl"):
 def save_index(index, index_path="faiss_index.idx"):
     if not _FAISS_AVAILABLE:
         raise RuntimeError("FAISS not available; cannot save FAISS index.")
-    faiss.write_index(index, index_path)
+    faiss.write_index(_to_cpu(index), index_path)
     print(f" FAISS index saved to {index_path}")
 
 
@@ -58,7 +149,7 @@ def load_index(index_path="faiss_index.idx"):
         raise RuntimeError("FAISS not available; cannot load FAISS index.")
     if not os.path.exists(index_path):
         raise FileNotFoundError(f"FAISS index file not found: {index_path}")
-    index = faiss.read_index(index_path)
+    index = _to_gpu(faiss.read_index(index_path))
     print(f" FAISS index loaded from {index_path}")
     return index
 
@@ -66,12 +157,16 @@ def load_index(index_path="faiss_index.idx"):
 # ---------------------------
 # Build index from embeddings
 # ---------------------------
-def build_faiss_index(embeddings: np.ndarray, normalize: bool = True):
+def build_faiss_index(embeddings: np.ndarray, normalize: bool = False):
     """
-    Create a FAISS flat (inner-product) index from embeddings.
+    Create a FAISS inner-product index from embeddings.
+    Small corpora use an FP16 scalar-quantized flat index, mid-sized corpora
+    (>= HNSW_MIN_VECTORS) an HNSW graph, and corpora with at least
+    IVF_PQ_MIN_VECTORS vectors use IVF-PQ for compressed, sublinear search.
     Args:
         embeddings: numpy array shape (n, d)
-        normalize: if True, L2-normalize embeddings (useful for cosine similarity)
+        normalize: if True, L2-normalize embeddings (useful for cosine similarity).
+                   Leave False for vectors from EmbeddingGenerator, which are already normalized.
     Returns:
         faiss.Index object
     """
@@ -82,13 +177,36 @@ def build_faiss_index(embeddings: np.ndarray, normalize: bool = True):
         raise ValueError("Embeddings must be a 2D numpy array (n_samples, dim)")
 
     n, d = embeddings.shape
+    # FAISS expects contiguous float32 input (stored embeddings may be FP16)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
     # Normalize for cosine similarity if requested
     if normalize:
         faiss.normalize_L2(embeddings)
 
-    # Use IndexFlatIP (inner product on normalized vectors = cosine similarity)
-    index = faiss.IndexFlatIP(d)
-    index.add(embeddings.astype(np.float32))
+    # Inner product on normalized vectors = cosine similarity
+    if n >= IVF_PQ_MIN_VECTORS:
+        nlist = int(4 * np.sqrt(n))
+        quantizer = faiss.IndexFlatIP(d)
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, 16, 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        index.add(embeddings)
+        index.nprobe = DEFAULT_NPROBE
+    elif _GPU_AVAILABLE:
+        # Neither HNSW nor the scalar quantizer runs on GPU; a brute-force scan
+        # there is faster than either on CPU at this size
+        index = faiss.IndexFlatIP(d)
+        index.add(embeddings)
+    elif n >= HNSW_MIN_VECTORS:
+        index = faiss.IndexHNSWFlat(d, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.add(embeddings)
+        index.hnsw.efSearch = DEFAULT_EF_SEARCH
+    else:
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        index.add(embeddings)
+
+    index = _to_gpu(index)
     print(f" Built FAISS index with {index.ntotal} vectors (dim={d})")
     return index
 
@@ -96,7 +214,7 @@ def build_faiss_index(embeddings: np.ndarray, normalize: bool = True):
 # ---------------------------
 # Add embeddings to existing index (and metadata)
 # ---------------------------
-def add_embeddings_to_index(embeddings_list, metadata_list, index=None, normalize=True):
+def add_embeddings_to_index(embeddings_list, metadata_list, index=None, normalize=False):
     """
     Add embeddings (list of numpy arrays or stacked array) and metadata to a FAISS index.
     If index is None and FAISS is available, it will create a new FAISS index.
@@ -126,7 +244,38 @@ def add_embeddings_to_index(embeddings_list, metadata_list, index=None, normaliz
 # ---------------------------
 # Search
 # ---------------------------
-def search_index(query_vec: np.ndarray, index, metadata_list, top_k: int = 5, normalize: bool = True):
+# Stacked (and optionally normalized) embedding matrix for the in-memory fallback,
+# keyed by id(metadata_list). Holds a reference to the list so the id stays valid.
+_MATRIX_CACHE = {}
+
+
+def _get_search_matrix(metadata_list, normalize: bool) -> np.ndarray:
+    key = (id(metadata_list), normalize)
+    cached = _MATRIX_CACHE.get(key)
+    if cached is not None and cached[0] is metadata_list and cached[1] == len(metadata_list):
+        return cached[2]
+
+    if isinstance(metadata_list, MetadataTable):
+        matrix = metadata_list.embedding_matrix().astype(np.float32)  # shape (n, d)
+    else:
+        vectors = []
+        for rec in metadata_list:
+            vec = rec.get("embedding")
+            if vec is None:
+                raise ValueError("Metadata records must contain 'embedding' for in-memory search fallback.")
+            vectors.append(np.asarray(vec))
+        matrix = np.stack(vectors, axis=0).astype(np.float32)  # shape (n, d)
+    if normalize:
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+
+    # Only the current metadata list is worth keeping; drop stale entries
+    _MATRIX_CACHE.clear()
+    _MATRIX_CACHE[key] = (metadata_list, len(metadata_list), matrix)
+    return matrix
+
+
+def search_index(query_vec: np.ndarray, index, metadata_list, top_k: int = 5, normalize: bool = False,
+                 nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH):
     """
     Search FAISS index (or in-memory fallback) for top_k nearest neighbors.
     Args:
@@ -134,6 +283,9 @@ def search_index(query_vec: np.ndarray, index, metadata_list, top_k: int = 5, no
         index: faiss.Index or None (for in-memory fallback)
         metadata_list: list of metadata dicts corresponding to vectors order
         top_k: number of top results
+        normalize: if True, L2-normalize the query (and in-memory matrix) before searching
+        nprobe: IVF cells to visit per query (ignored for non-IVF indexes)
+        ef_search: HNSW candidate list size per query (ignored for non-HNSW indexes)
     Returns:
         List of tuples: (metadata, score)
     """
@@ -148,8 +300,15 @@ def search_index(query_vec: np.ndarray, index, metadata_list, top_k: int = 5, no
         faiss.normalize_L2(query_vec)
 
     if _FAISS_AVAILABLE and index is not None:
+        # Search-time parameters are not reliably persisted, so pass them per call
+        # rather than mutating the shared index
+        params = None
+        if hasattr(index, "nprobe"):
+            params = faiss.SearchParametersIVF(nprobe=nprobe)
+        if hasattr(index, "hnsw"):
+            params = faiss.SearchParametersHNSW(efSearch=max(ef_search, top_k))
         # perform search
-        distances, indices = index.search(query_vec.astype(np.float32), top_k)
+        distances, indices = index.search(query_vec.astype(np.float32), top_k, params=params)
         results = []
         for idx, dist in zip(indices[0], distances[0]):
             if idx < 0 or idx >= len(metadata_list):
@@ -160,25 +319,22 @@ def search_index(query_vec: np.ndarray, index, metadata_list, top_k: int = 5, no
         return results
     else:
         # In-memory brute-force search using cosine similarity
-        # Build matrix from metadata embeddings if available
-        matrix = []
-        for rec in metadata_list:
-            vec = rec.get("embedding")
-            if vec is None:
-                raise ValueError("Metadata records must contain 'embedding' for in-memory search fallback.")
-            matrix.append(np.asarray(vec))
-        matrix = np.stack(matrix, axis=0)  # shape (n, d)
-
-        # normalize
+        matrix = _get_search_matrix(metadata_list, normalize)
         if normalize:
-            matrix = matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12)
             q = query_vec / (np.linalg.norm(query_vec, axis=1, keepdims=True) + 1e-12)
         else:
             q = query_vec
 
-        sims = (matrix @ q.T).squeeze(axis=1)  # cosine sim if normalized
-        # get top_k indices
-        top_idx = np.argsort(-sims)[:top_k]
+        sims = matrix @ q.astype(np.float32).ravel()  # cosine sim if normalized
+        # get top_k indices via partial selection, then order just those
+        k = min(top_k, sims.shape[0])
+        if k <= 0:
+            return []
+        if k < sims.shape[0]:
+            top_idx = np.argpartition(-sims, k - 1)[:k]
+        else:
+            top_idx = np.arange(k)
+        top_idx = top_idx[np.argsort(-sims[top_idx])]
         results = []
         for idx in top_idx:
             results.append((metadata_list[int(idx)], float(sims[int(idx)])))
@@ -191,7 +347,7 @@ def search_index(query_vec: np.ndarray, index, metadata_list, top_k: int = 5, no
 if __name__ == "__main__":
     # Quick demo (requires an embeddings_store.pkl created by embeddings_generator)
     EMB_PATH = "embeddings_store.pkl"
-    META_PATH = "meta_store.pkl"
+    META_PATH = "meta_store.arrow"
     IDX_PATH = "faiss_index.idx"
 
     if not os.path.exists(EMB_PATH):
@@ -199,6 +355,10 @@ if __name__ == "__main__":
     else:
         with open(EMB_PATH, "rb") as f:
             embeddings_data = pickle.load(f)
+        # Newer stores keep vectors in a sidecar .npy file
+        if os.path.exists(EMB_PATH + ".npy"):
+            stored = np.load(EMB_PATH + ".npy")
+            embeddings_data = [dict(rec, embedding=vec) for rec, vec in zip(embeddings_data, stored)]
 
         # Build numpy array and metadata list
         vectors = []
@@ -215,7 +375,8 @@ if __name__ == "__main__":
 
         vectors = np.stack(vectors, axis=0)
         if _FAISS_AVAILABLE:
-            idx = build_faiss_index(vectors)
+            # Older stores may hold unnormalized vectors
+            idx = build_faiss_index(vectors, normalize=True)
             save_index(idx, IDX_PATH)
             save_metadata(metadatas, META_PATH)
             print("FAISS index built and saved.")
@@ -4,6 +4,7 @@ view_embeddings.py
 Simple utility to inspect the contents of embeddings_store.pkl
 """
 
+import os
 import pickle
 import numpy as np
 
@@ -19,6 +20,11 @@ def view_embeddings(path="embeddings_store.pkl", show_text=True, limit=3):
     with open(path, "rb") as f:
         data = pickle.load(f)
 
+    # Newer stores keep vectors in a sidecar .npy file
+    if os.path.exists(path + ".npy"):
+        vectors = np.load(path + ".npy")
+        data = [dict(rec, embedding=vec) for rec, vec in zip(data, vectors)]
+
     print(f"\n Loaded {len(data)} records from {path}\n")
 
     for i, record in enumerate(data[:limit], start=1):